@@ -1,23 +1,196 @@
+import asyncio
+import collections
+import difflib
+import hashlib
+import json
+import logging
+import logging.handlers
 import os
 import platform
+import queue
+import re
+import sqlite3
 import sys
+import tempfile
+import threading
+import time
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
 
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; memory updates go unlocked there
+    fcntl = None  # type: ignore[assignment]
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import faiss
+import httpx
+import numpy as np
+import openai
+from diskcache import Cache
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, __version__ as flask_version
-from openai import OpenAI, __version__ as openai_version
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    render_template,
+    request,
+    stream_with_context,
+    __version__ as flask_version,
+)
+from openai import AsyncOpenAI, __version__ as openai_version
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential,
+)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+MEMORY_DIR = os.path.join(BASE_DIR, "memories")
+RULES_MEMORY_FILE = "rules.md"
+RULES_LOCK_FILE = ".rules.lock"
+MAX_MEMORY_RULES = 25
+RESPONSE_CACHE_TTL = 24 * 60 * 60
+SEMANTIC_CACHE_PATH = os.path.join(CACHE_DIR, "semantic.sqlite3")
+SEMANTIC_CACHE_THRESHOLD = 0.92
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 1536
+AUDIT_FLUSH_INTERVAL = 5.0
+NO_ISSUES_SENTINEL = re.compile(r"no substantive issues remain", re.IGNORECASE)
+MAX_CONCURRENT_REQUESTS = 32
+SERVER_BIND = "127.0.0.1:5000"
+SERVER_WORKERS = 4
+SERVER_THREADS = 100
+BATCH_POLL_INTERVAL = 30.0
+NEAR_IDENTICAL_CRITIQUE_RATIO = 0.9
+DISTINCT_CRITIQUE_RATIO = 0.3
 
 app = Flask(__name__, template_folder=TEMPLATE_DIR)
-
-_client: Optional[OpenAI] = None
+# index.html does not change while the server runs, so skip Jinja's
+# per-render mtime check on the template.
+app.config["TEMPLATES_AUTO_RELOAD"] = False
+app.jinja_env.auto_reload = False
+
+_EMPTY_LOOPS: Tuple[Dict[str, str], ...] = ()
+
+_client: Optional[AsyncOpenAI] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_request_semaphore: Optional[asyncio.Semaphore] = None
+_response_cache: Optional[Cache] = None
+_semantic_store: Optional[sqlite3.Connection] = None
+_semantic_indexes: Dict[str, faiss.IndexIDMap] = {}
+_semantic_synced_id: int = 0
+_semantic_expiry: "collections.deque[Tuple[float, str, int]]" = collections.deque()
 _api_key: Optional[str] = None
 _client_ready: bool = False
 _client_error: Optional[str] = None
 _startup_events: List[Dict[str, str]] = []
+_startup_messages_cached: Tuple[Dict[str, str], ...] = ()
+_audit_dir_ready: bool = False
+_startup_logger = logging.getLogger("marny.startup")
+_startup_log_buffer: Optional[logging.handlers.MemoryHandler] = None
+_memory_logger = logging.getLogger("marny.memory")
+_reviewer_memory: Tuple[Tuple[Tuple[str, float], ...], str] = ((), "")
+
+# Static rubric shared by the review and revision system prompts. Both
+# prompts are sent first and byte-identical on every call so that OpenAI's
+# prompt cache (which applies to prefixes of 1024+ tokens) can discount them;
+# per-request content always goes in the user turn.
+REVIEW_RUBRIC = (
+    "Definitions / Rubric\n\n"
+    "Substantive issue: a problem that, if left unaddressed, would cause a "
+    "careful expert reader to doubt the document's central conclusions. "
+    "Substantive issues concern what the document claims and whether those "
+    "claims are adequately supported, not how the claims are phrased.\n\n"
+    "Methodological gap: a step in the reasoning or procedure that is missing, "
+    "unjustified, or inconsistent with the stated aims. Examples include an "
+    "analysis that cannot answer the question it was chosen to answer, a "
+    "comparison without a stated baseline, a sample or scope that does not "
+    "support the breadth of the conclusion, or a procedure described in too "
+    "little detail for a reader to judge whether it was sound.\n\n"
+    "Logical flaw: an inference that does not follow from its premises. "
+    "Examples include treating correlation as causation, generalizing from a "
+    "single case, equivocating on a key term, affirming the consequent, or "
+    "drawing a conclusion that contradicts an earlier statement in the same "
+    "document.\n\n"
+    "Unsupported claim: a factual or evaluative assertion that the document "
+    "relies on but neither demonstrates nor attributes. A claim is adequately "
+    "supported when the document provides evidence, a clear argument, or an "
+    "explicit and verifiable source. Widely accepted background knowledge "
+    "does not require support. Do not invent sources, and do not ask for a "
+    "citation merely because one could be added.\n\n"
+    "Unclear core argument: the reader cannot state, after a careful reading, "
+    "what the document is trying to establish or how its sections contribute "
+    "to that goal. Unclear phrasing of a peripheral sentence is not an unclear "
+    "core argument.\n\n"
+    "Bias: a systematic tilt in how evidence is selected, weighed, or "
+    "presented that favors a predetermined conclusion, such as ignoring "
+    "obvious counterevidence, holding competing positions to different "
+    "standards, or framing alternatives uncharitably.\n\n"
+    "Circular reasoning: an argument whose conclusion is assumed, openly or "
+    "in disguised form, by one of its premises.\n\n"
+    "Nitpick: a remark about word choice, tone, formatting, ordering, "
+    "length, or style that does not change whether the document's claims are "
+    "supported. Nitpicks are out of scope even when they are correct.\n\n"
+    "Previously addressed issue: a concern raised in an earlier review round "
+    "that the current text resolves, even if it is resolved differently than "
+    "the earlier review suggested. Do not raise it again unless the "
+    "resolution itself introduces a new substantive issue.\n\n"
+    "Severity guide:\n"
+    "- Critical: the central conclusion does not follow or is contradicted by "
+    "the document's own content.\n"
+    "- Major: an important supporting claim or method is missing or "
+    "unjustified, weakening but not invalidating the conclusion.\n"
+    "- Minor: a localized gap that a reader could fill without changing the "
+    "conclusion. Minor gaps matter only once no critical or major issues "
+    "remain, and nitpicks never matter.\n\n"
+    "Review procedure:\n"
+    "1. Identify the document's central claim and its main supporting claims.\n"
+    "2. For each supporting claim, check whether the evidence or argument "
+    "given is sufficient, relevant, and internally consistent.\n"
+    "3. Check whether the method or line of reasoning can actually establish "
+    "the central claim.\n"
+    "4. Check for bias and circularity across the document as a whole.\n"
+    "5. Report each substantive issue once, naming where it occurs, why it "
+    "matters, and what kind of change would resolve it.\n\n"
+    "Worked distinctions:\n"
+    "- 'The survey sample is drawn from a single university, yet the "
+    "conclusion is stated for all adults' is substantive (scope exceeds "
+    "evidence). 'The survey section would read better before the "
+    "literature review' is a nitpick.\n"
+    "- 'The claimed 40% improvement is reported without a baseline or "
+    "measurement method' is substantive (unsupported claim). 'Use percent "
+    "instead of %' is a nitpick.\n"
+    "- 'Section 3 defines success as user retention, but Section 5 "
+    "evaluates success by revenue' is substantive (equivocation on a key "
+    "term). 'Success is an overloaded word; consider another' is a "
+    "nitpick.\n"
+    "- 'The argument that the framework is reliable relies on results "
+    "produced by the framework itself' is substantive (circular reasoning). "
+    "'The framework name should be capitalized consistently' is a nitpick.\n"
+    "- 'Only studies supporting the hypothesis are discussed, although the "
+    "document acknowledges conflicting results exist' is substantive (bias). "
+    "'The tone toward competing studies is a little dismissive' is a nitpick "
+    "unless the dismissal replaces an actual argument.\n\n"
+    "Methodologically sound: the document has no critical or major issues "
+    "and any remaining minor gaps would not change an expert's assessment."
+)
 
 REVIEW_PROMPT = (
     "You are a rigorous peer reviewer applying The Recursive Protocol (TRP). "
@@ -32,23 +205,461 @@ REVIEW_PROMPT = (
     "- Stylistic preferences\n"
     "- Issues already addressed in prior revisions\n\n"
     "If the document is methodologically sound, state: 'No substantive issues remain.'"
-    
+    "\n\n" + REVIEW_RUBRIC + "\n\n"
+    "Output expectations: be specific and concise, order issues from most to "
+    "least severe, and do not rewrite the document yourself during review."
 )
 
-def get_client() -> OpenAI:
+REVISION_PROMPT = (
+    "You are revising a document based on peer review feedback. "
+    "Rewrite the document to address all critique points while preserving "
+    "the core content and intent. Return only the revised document text.\n\n"
+    "The reviewer applied the rubric below. Resolve the substantive issues it "
+    "describes without introducing unverifiable citations or new claims the "
+    "document cannot support.\n\n" + REVIEW_RUBRIC
+)
+
+MEMORY_PROMPT = (
+    "You maintain a reviewer's memory of lessons learned from past peer "
+    "reviews. You will receive the sequence of critiques from one refinement "
+    "run that ended with the reviewer finding no substantive issues. Distill "
+    "the general, reusable rules that the revisions had to satisfy before the "
+    "reviewer was content (for example, 'State the baseline for every "
+    "quantitative claim'). Exclude anything specific to this document's topic. "
+    "Return at most five rules as a markdown bullet list and nothing else."
+)
+
+LOOP_STEP_PROMPT = (
+    "You are continuing a recursive review. The user turn contains your "
+    "previous critique and the document as revised in response to it. In a "
+    "single response:\n"
+    "1. critique: review the revised document as instructed above.\n"
+    "2. verdict: 'RESOLVED' if no substantive issues remain; 'NITPICKING' if "
+    "the new critique has shifted from real methodological gaps to minor "
+    "semantic issues or restates points from the previous critique; "
+    "otherwise 'SUBSTANTIVE'.\n"
+    "3. revision: only when the verdict is 'SUBSTANTIVE', rewrite the "
+    "document to address every point in your new critique while preserving "
+    "its core content and intent, without unverifiable citations. For any "
+    "other verdict, return an empty string."
+)
+
+LOOP_STEP_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "loop_step",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "critique": {"type": "string"},
+                "verdict": {
+                    "type": "string",
+                    "enum": ["SUBSTANTIVE", "NITPICKING", "RESOLVED"],
+                },
+                "revision": {"type": "string"},
+            },
+            "required": ["critique", "verdict", "revision"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+T = TypeVar("T")
+DeltaCallback = Callable[[str], None]
+EventCallback = Callable[[str, Dict[str, Any]], None]
+
+
+# Transient OpenAI failures (rate limits, timeouts, dropped connections) are
+# retried up to 3 attempts with exponential backoff instead of aborting the
+# whole refinement loop; the original error is re-raised if all attempts fail.
+retry_transient_openai_errors = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=2, max=30),
+    retry=retry_if_exception_type(
+        (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)
+    ),
+    reraise=True,
+)
+
+
+@retry_transient_openai_errors
+async def call_openai(request: Callable[[], Awaitable[T]]) -> T:
+    """Make one OpenAI request under the concurrency limit and retry policy."""
+    async with get_request_semaphore():
+        return await request()
+
+
+def get_client() -> AsyncOpenAI:
     global _client
     if _client is None:
         if not _api_key:
             raise RuntimeError(
                 "OPENAI_API_KEY is not configured. Unable to create OpenAI client."
             )
-        _client = OpenAI(api_key=_api_key)
+        # One HTTP/2 keep-alive pool per process, shared by every request on
+        # the background loop, so warm calls skip the TCP and TLS handshakes.
+        http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=MAX_CONCURRENT_REQUESTS,
+                max_keepalive_connections=MAX_CONCURRENT_REQUESTS,
+            ),
+        )
+        # Retries are handled by retry_transient_openai_errors alone; the
+        # SDK's own retries would multiply its attempts.
+        _client = AsyncOpenAI(
+            api_key=_api_key, http_client=http_client, max_retries=0
+        )
     return _client
 
 
+def get_request_semaphore() -> asyncio.Semaphore:
+    """Limit in-flight OpenAI requests to MAX_CONCURRENT_REQUESTS."""
+    global _request_semaphore
+    if _request_semaphore is None:
+        _request_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return _request_semaphore
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the background event loop that runs all OpenAI requests.
+    A single long-lived loop lets the shared AsyncOpenAI client keep its
+    connection pool across Flask requests instead of binding it to a
+    throwaway loop per call.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="marny-openai", daemon=True
+            ).start()
+            _loop = loop
+    return _loop
+
+
+def run_async(coroutine: Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine on the background loop and block until it finishes."""
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
+
+
+def get_response_cache() -> Cache:
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = Cache(os.path.join(CACHE_DIR, "llm"))
+    return _response_cache
+
+
+def response_cache_key(model: str, system_prompt: str, user_content: str) -> str:
+    payload = "\0".join((model, system_prompt, user_content))
+    return hashlib.blake2b(payload.encode("utf-8")).hexdigest()
+
+
+async def cached_chat_completion(
+    model: str,
+    system_prompt: str,
+    user_content: str,
+    on_delta: Optional[DeltaCallback] = None,
+    stop_pattern: Optional[re.Pattern] = None,
+    guidelines: str = "",
+) -> str:
+    """
+    Return the completion for a system/user prompt pair, reusing a cached
+    response when the exact same request was answered before.
+    Non-empty guidelines are sent as a second system message, after the
+    static prompt so the cacheable prefix is unchanged. They are advisory
+    and evolve after every learning run, so they are deliberately left out
+    of the cache key.
+    Requests are sent with temperature 0 so identical inputs yield identical
+    outputs, which is what makes exact-match caching safe.
+    """
+    cache = get_response_cache()
+    key = response_cache_key(model, system_prompt, user_content)
+    cached = cache.get(key)
+    if cached is not None:
+        if on_delta is not None:
+            on_delta(cached)
+        return cached
+
+    messages = [{"role": "system", "content": system_prompt}]
+    if guidelines:
+        messages.append({"role": "system", "content": guidelines})
+    messages.append({"role": "user", "content": user_content})
+
+    content = await stream_chat_completion(model, messages, on_delta, stop_pattern)
+    cache.set(key, content, expire=RESPONSE_CACHE_TTL)
+    return content
+
+
+@retry_transient_openai_errors
+async def open_chat_stream(model: str, messages: List[Dict[str, str]]) -> Any:
+    """Start a streamed chat completion, retrying transient failures."""
+    return await get_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0,
+        stream=True,
+    )
+
+
+async def stream_chat_completion(
+    model: str,
+    messages: List[Dict[str, str]],
+    on_delta: Optional[DeltaCallback] = None,
+    stop_pattern: Optional[re.Pattern] = None,
+) -> str:
+    """
+    Stream a chat completion and return its text.
+    Each text delta is passed to on_delta as it arrives, and the stream is
+    abandoned as soon as stop_pattern (a literal phrase) matches, since
+    nothing after it changes the outcome.
+    Only opening the stream is retried: once deltas have been passed on, a
+    retry would replay them to the consumer, so a failure mid-stream is
+    raised instead.
+    """
+    parts: List[str] = []
+    tail = ""
+    async with get_request_semaphore():
+        stream = await open_chat_stream(model, messages)
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                parts.append(delta)
+                # on_delta may raise (e.g. when the consumer disconnected); the
+                # finally below still releases the connection.
+                if on_delta is not None:
+                    on_delta(delta)
+                if stop_pattern is not None:
+                    # Only the text around the newest delta can complete the phrase.
+                    window = tail + delta
+                    if stop_pattern.search(window) is not None:
+                        break
+                    tail = window[-(len(stop_pattern.pattern) - 1):]
+        finally:
+            await stream.close()
+
+    return "".join(parts).strip()
+
+
+def get_semantic_store() -> sqlite3.Connection:
+    global _semantic_store
+    if _semantic_store is None:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Gunicorn workers share the file, so wait briefly on their locks.
+        connection = sqlite3.connect(
+            SEMANTIC_CACHE_PATH, timeout=5.0, check_same_thread=False
+        )
+        columns = {
+            row[1] for row in connection.execute("PRAGMA table_info(critiques)")
+        }
+        if columns and "created_at" not in columns:
+            # Sidecars from before expiry was tracked; it is only a cache.
+            connection.execute("DROP TABLE critiques")
+        # AUTOINCREMENT keeps pruned ids from being reused, which would hide
+        # new rows from the incremental sync.
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS critiques ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "prompt_key TEXT NOT NULL, "
+            "embedding BLOB NOT NULL, "
+            "critique TEXT NOT NULL, "
+            "created_at REAL NOT NULL)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS critiques_created_at "
+            "ON critiques (created_at)"
+        )
+        connection.commit()
+        _semantic_store = connection
+    return _semantic_store
+
+
+def sync_semantic_indexes() -> None:
+    """
+    Bring the in-memory FAISS indexes up to date with the sqlite sidecar.
+    There is one index per prompt key, so a lookup only ever compares
+    against critiques made under the same prompt. Rows are loaded
+    incrementally by id, which also picks up critiques stored by other
+    gunicorn workers; row ids in the sidecar double as FAISS ids.
+    Entries older than RESPONSE_CACHE_TTL are dropped from the indexes, so
+    semantic matches expire along with the exact-match cache.
+    """
+    global _semantic_synced_id
+    cutoff = time.time() - RESPONSE_CACHE_TTL
+    expired: Dict[str, List[int]] = {}
+    while _semantic_expiry and _semantic_expiry[0][0] < cutoff:
+        _, prompt_key, row_id = _semantic_expiry.popleft()
+        expired.setdefault(prompt_key, []).append(row_id)
+    for prompt_key, row_ids in expired.items():
+        _semantic_indexes[prompt_key].remove_ids(np.array(row_ids, dtype=np.int64))
+
+    rows = get_semantic_store().execute(
+        "SELECT id, prompt_key, embedding, created_at FROM critiques "
+        "WHERE id > ? ORDER BY id",
+        (_semantic_synced_id,),
+    ).fetchall()
+    for row_id, prompt_key, embedding, created_at in rows:
+        _semantic_synced_id = row_id
+        if created_at < cutoff:
+            continue
+        index = _semantic_indexes.get(prompt_key)
+        if index is None:
+            index = faiss.IndexIDMap(faiss.IndexFlatIP(EMBEDDING_DIMENSIONS))
+            _semantic_indexes[prompt_key] = index
+        index.add_with_ids(
+            np.frombuffer(embedding, dtype=np.float32).reshape(1, -1),
+            np.array([row_id], dtype=np.int64),
+        )
+        _semantic_expiry.append((created_at, prompt_key, row_id))
+
+
+@retry_transient_openai_errors
+async def embed_document(document_text: str) -> np.ndarray:
+    async with get_request_semaphore():
+        response = await get_client().embeddings.create(
+            model=EMBEDDING_MODEL, input=document_text
+        )
+    vector = np.array([response.data[0].embedding], dtype=np.float32)
+    faiss.normalize_L2(vector)
+    return vector
+
+
+def lookup_semantic_critique(vector: np.ndarray, prompt_key: str) -> Optional[str]:
+    sync_semantic_indexes()
+    index = _semantic_indexes.get(prompt_key)
+    if index is None or index.ntotal == 0:
+        return None
+
+    scores, ids = index.search(vector, 1)
+    if ids[0][0] == -1 or scores[0][0] < SEMANTIC_CACHE_THRESHOLD:
+        return None
+
+    row = get_semantic_store().execute(
+        "SELECT critique FROM critiques WHERE id = ? AND created_at >= ?",
+        (int(ids[0][0]), time.time() - RESPONSE_CACHE_TTL),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def store_semantic_critique(vector: np.ndarray, prompt_key: str, critique: str) -> None:
+    """
+    Persist a critique; indexes pick it up on their next sync.
+    Rows past RESPONSE_CACHE_TTL are pruned in the same transaction, so the
+    sidecar stays bounded by one TTL's worth of critiques.
+    """
+    store = get_semantic_store()
+    now = time.time()
+    store.execute(
+        "DELETE FROM critiques WHERE created_at < ?", (now - RESPONSE_CACHE_TTL,)
+    )
+    store.execute(
+        "INSERT INTO critiques (prompt_key, embedding, critique, created_at) "
+        "VALUES (?, ?, ?, ?)",
+        (prompt_key, vector.tobytes(), critique, now),
+    )
+    store.commit()
+
+
+class AuditLogFormatter(logging.Formatter):
+    """
+    Formatter that renders each second's timestamp only once.
+    Startup emits dozens of records within the same second, so the
+    formatted time is reused until the clock moves on.
+    """
+
+    def __init__(self, fmt: str, datefmt: str) -> None:
+        super().__init__(fmt, datefmt)
+        self._cached_second: Optional[int] = None
+        self._cached_timestamp = ""
+
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None) -> str:
+        second = int(record.created)
+        if second != self._cached_second:
+            self._cached_timestamp = time.strftime(
+                datefmt or self.datefmt, time.localtime(second)
+            )
+            self._cached_second = second
+        return self._cached_timestamp
+
+
+def flush_audit_logs_periodically(handler: logging.Handler) -> None:
+    while True:
+        time.sleep(AUDIT_FLUSH_INTERVAL)
+        handler.flush()
+
+
+def start_audit_flush_thread(handler: logging.Handler) -> None:
+    threading.Thread(
+        target=flush_audit_logs_periodically,
+        args=(handler,),
+        name="marny-audit-flush",
+        daemon=True,
+    ).start()
+
+
+def get_startup_logger() -> logging.Logger:
+    """
+    Return the logger that writes audit_trails/startup.log.
+    Records are held in a MemoryHandler and written in batches: when 100
+    records are pending, when an error is logged, every
+    AUDIT_FLUSH_INTERVAL seconds from a background thread, and at exit.
+    """
+    global _startup_log_buffer
+    if _startup_log_buffer is None:
+        ensure_audit_directory()
+        file_handler = logging.FileHandler(
+            os.path.join("audit_trails", "startup.log"),
+            encoding="utf-8",
+            delay=True,
+        )
+        file_handler.setFormatter(
+            AuditLogFormatter(
+                "%(asctime)s [%(levelname)s] %(message)s",
+                datefmt="%Y-%m-%d %H:%M:%S",
+            )
+        )
+        _startup_log_buffer = logging.handlers.MemoryHandler(
+            capacity=100, target=file_handler
+        )
+        _startup_logger.addHandler(_startup_log_buffer)
+        _startup_logger.setLevel(logging.INFO)
+        _startup_logger.propagate = False
+        start_audit_flush_thread(_startup_log_buffer)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=discard_inherited_startup_records)
+    return _startup_logger
+
+
+def flush_startup_log() -> None:
+    if _startup_log_buffer is not None:
+        _startup_log_buffer.flush()
+
+
+def discard_inherited_startup_records() -> None:
+    """
+    After a fork, drop the startup records copied from the parent.
+    The parent writes them itself; a gunicorn worker flushing its copy at
+    exit would duplicate every line in startup.log. Threads do not survive
+    the fork, so the child also starts its own periodic flush for the
+    events it records later. Registered with os.register_at_fork, so this
+    runs under an external gunicorn command as well as under main().
+    """
+    if _startup_log_buffer is not None:
+        _startup_log_buffer.acquire()
+        try:
+            _startup_log_buffer.buffer.clear()
+        finally:
+            _startup_log_buffer.release()
+        start_audit_flush_thread(_startup_log_buffer)
+
+
 def record_startup_event(message: str, level: str = "info") -> None:
-    ensure_audit_directory()
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     normalized_level = level.lower()
     prefix = {"info": "INFO", "warning": "WARNING", "error": "ERROR"}.get(
         normalized_level,
@@ -59,13 +670,11 @@ def record_startup_event(message: str, level: str = "info") -> None:
 
     _startup_events.append({"level": normalized_level, "message": message})
 
-    log_path = os.path.join("audit_trails", "startup.log")
-    with open(log_path, "a", encoding="utf-8") as startup_log:
-        startup_log.write(f"{timestamp} [{prefix}] {message}\n")
+    get_startup_logger().log(logging.getLevelName(prefix), message)
 
 
-def get_startup_messages() -> List[Dict[str, str]]:
-    return [event for event in _startup_events if event["level"] != "info"]
+def get_startup_messages() -> Tuple[Dict[str, str], ...]:
+    return _startup_messages_cached
 
 
 def inspect_env_file(env_path: str) -> None:
@@ -74,104 +683,341 @@ def inspect_env_file(env_path: str) -> None:
 
     try:
         with open(env_path, "r", encoding="utf-8") as env_file:
-            lines = env_file.read().splitlines()
+            # True while the previous line was the OPENAI_API_KEY assignment,
+            # so a split key can be detected without buffering the file.
+            after_api_key = False
+            for index, raw_line in enumerate(env_file, start=1):
+                stripped = raw_line.strip()
+                key, separator, value = stripped.partition("=")
+
+                if after_api_key:
+                    after_api_key = False
+                    if stripped and not separator and not stripped.startswith("#"):
+                        record_startup_event(
+                            (
+                                "Detected additional text on the line after OPENAI_API_KEY. "
+                                "This usually means the key was split across multiple lines."
+                            ),
+                            level="warning",
+                        )
+
+                if not stripped or stripped.startswith("#"):
+                    continue
+
+                if not separator:
+                    record_startup_event(
+                        (
+                            f"Line {index} of .env has no '=': '{stripped}'. If this was "
+                            "intended to continue the OPENAI_API_KEY, merge it back onto a "
+                            "single line."
+                        ),
+                        level="warning",
+                    )
+                    continue
+
+                if key != "OPENAI_API_KEY":
+                    continue
+
+                if not value:
+                    record_startup_event(
+                        "OPENAI_API_KEY is defined but empty in the .env file.",
+                        level="warning",
+                    )
+
+                if len(value) < 50:
+                    record_startup_event(
+                        (
+                            "OPENAI_API_KEY looks shorter than expected. Ensure the full "
+                            "key is present on one line in the .env file."
+                        ),
+                        level="warning",
+                    )
+
+                after_api_key = True
     except OSError as exc:  # noqa: PERF203 - user feedback is more important here
         record_startup_event(
             f"Could not read .env file for validation: {exc}",
             level="warning",
         )
-        return
 
-    for index, raw_line in enumerate(lines, start=1):
-        stripped = raw_line.strip()
-        if not stripped or stripped.startswith("#"):
-            continue
 
-        if "=" not in stripped:
-            record_startup_event(
-                (
-                    f"Line {index} of .env has no '=': '{stripped}'. If this was "
-                    "intended to continue the OPENAI_API_KEY, merge it back onto a "
-                    "single line."
-                ),
-                level="warning",
-            )
-            continue
-
-        key, value = stripped.split("=", 1)
-        if key != "OPENAI_API_KEY":
-            continue
-
-        if not value:
-            record_startup_event(
-                "OPENAI_API_KEY is defined but empty in the .env file.",
-                level="warning",
-            )
+async def generate_critique(
+    document_text: str,
+    semantic: bool = False,
+    on_delta: Optional[DeltaCallback] = None,
+    guidelines: str = "",
+) -> str:
+    """
+    Generate a critique of the document, optionally informed by guidelines
+    recalled from the reviewer memory.
+    With semantic set, a near-duplicate of a previously reviewed document
+    reuses that document's critique. The exact-match cache is still checked
+    first, and any failure in the semantic layer falls back to the API.
+    """
+    model = "gpt-4o-mini"
+    if not semantic:
+        return await cached_chat_completion(
+            model,
+            REVIEW_PROMPT,
+            document_text,
+            on_delta=on_delta,
+            stop_pattern=NO_ISSUES_SENTINEL,
+            guidelines=guidelines,
+        )
 
-        if len(value) < 50:
-            record_startup_event(
-                (
-                    "OPENAI_API_KEY looks shorter than expected. Ensure the full "
-                    "key is present on one line in the .env file."
-                ),
-                level="warning",
-            )
+    cached = get_response_cache().get(
+        response_cache_key(model, REVIEW_PROMPT, document_text)
+    )
+    if cached is not None:
+        if on_delta is not None:
+            on_delta(cached)
+        return cached
 
-        next_index = index
-        if next_index < len(lines):
-            next_line = lines[next_index].strip()
-            if next_line and "=" not in next_line and not next_line.startswith("#"):
-                record_startup_event(
-                    (
-                        "Detected additional text on the line after OPENAI_API_KEY. "
-                        "This usually means the key was split across multiple lines."
-                    ),
-                    level="warning",
-                )
+    prompt_key = response_cache_key(model, REVIEW_PROMPT, "")
+    try:
+        vector: Optional[np.ndarray] = await embed_document(document_text)
+        reused = lookup_semantic_critique(vector, prompt_key)
+    except Exception:  # noqa: BLE001 - the semantic cache is best effort
+        vector = None
+        reused = None
+    if reused is not None:
+        if on_delta is not None:
+            on_delta(reused)
+        return reused
+
+    critique_text = await cached_chat_completion(
+        model,
+        REVIEW_PROMPT,
+        document_text,
+        on_delta=on_delta,
+        stop_pattern=NO_ISSUES_SENTINEL,
+        guidelines=guidelines,
+    )
+    if vector is not None:
+        try:
+            store_semantic_critique(vector, prompt_key, critique_text)
+        except Exception:  # noqa: BLE001 - the semantic cache is best effort
+            pass
+    return critique_text
 
 
-def generate_critique(document_text: str) -> str:
-    response = get_client().chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": REVIEW_PROMPT},
-            {"role": "user", "content": document_text},
-        ],
+async def generate_revision(
+    document_text: str, critique: str, on_delta: Optional[DeltaCallback] = None
+) -> str:
+    """Generate a revised document based on the critique."""
+    return await cached_chat_completion(
+        "gpt-4o-mini",
+        REVISION_PROMPT,
+        (
+            f"Original Document:\n{document_text}\n\n"
+            f"Critique:\n{critique}\n\n"
+            "Provide the revised document:"
+        ),
+        on_delta=on_delta,
     )
-    return response.choices[0].message.content.strip()
 
 
-def generate_revision(document_text: str, critique: str) -> str:
-    """Generate a revised document based on the critique."""
-    client = get_client()
-    revision_prompt = (
-        "You are revising a document based on peer review feedback. "
-        "Rewrite the document to address all critique points while preserving "
-        "the core content and intent. Return only the revised document text."
+def parse_loop_step(content: str) -> Dict[str, str]:
+    """Parse and check a structured loop step returned by the model."""
+    try:
+        step = json.loads(content)
+        critique_text = step["critique"].strip()
+        verdict = step["verdict"]
+        revision = step["revision"].strip()
+    except (ValueError, TypeError, KeyError, AttributeError) as exc:
+        raise RuntimeError(f"The model returned a malformed loop step: {exc}") from exc
+    if verdict not in ("SUBSTANTIVE", "NITPICKING", "RESOLVED"):
+        raise RuntimeError(f"The model returned an unknown verdict: {verdict!r}")
+    return {"critique": critique_text, "verdict": verdict, "revision": revision}
+
+
+async def generate_loop_step(
+    document_text: str, previous_critique: str, guidelines: str = ""
+) -> Dict[str, str]:
+    """
+    Critique, evaluate and revise a document with one structured request.
+    REVIEW_PROMPT stays the first system message so the step shares the
+    cached prompt prefix with standalone critiques.
+    Returns {"critique", "verdict", "revision"}; revision is empty unless
+    the verdict is SUBSTANTIVE. Only steps that parse are cached.
+    """
+    model = "gpt-4o-mini"
+    user_content = (
+        f"Previous critique:\n{previous_critique}\n\n"
+        f"Revised document:\n{document_text}"
     )
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": revision_prompt},
-            {
-                "role": "user",
-                "content": (
-                    f"Original Document:\n{document_text}\n\n"
-                    f"Critique:\n{critique}\n\n"
-                    "Provide the revised document:"
-                ),
-            },
-        ],
+    cache = get_response_cache()
+    key = response_cache_key(
+        model, REVIEW_PROMPT + "\0" + LOOP_STEP_PROMPT, user_content
+    )
+    content = cache.get(key)
+    if content is not None:
+        return parse_loop_step(content)
+
+    messages = [
+        {"role": "system", "content": REVIEW_PROMPT},
+        {"role": "system", "content": LOOP_STEP_PROMPT},
+    ]
+    if guidelines:
+        messages.append({"role": "system", "content": guidelines})
+    messages.append({"role": "user", "content": user_content})
+
+    response = await call_openai(
+        lambda: get_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0,
+            response_format=LOOP_STEP_RESPONSE_FORMAT,
+        )
     )
-    return response.choices[0].message.content.strip()
+    choice = response.choices[0]
+    if choice.message.refusal:
+        raise RuntimeError(f"The model refused the loop step: {choice.message.refusal}")
+    if choice.finish_reason == "length":
+        raise RuntimeError(
+            "The loop step was cut off at the output limit; the document may be "
+            "too long for a combined critique and revision."
+        )
+    if choice.finish_reason != "stop" or choice.message.content is None:
+        raise RuntimeError(
+            f"The loop step did not complete (finish reason: {choice.finish_reason})."
+        )
+
+    step = parse_loop_step(choice.message.content)
+    cache.set(key, choice.message.content, expire=RESPONSE_CACHE_TTL)
+    return step
+
+
+def resolve_loop_step(
+    step: Dict[str, str], previous_critique: str, iteration: int
+) -> Tuple[Tuple[bool, str], Union[str, BaseException]]:
+    """
+    Turn a structured loop step into the same shape as evaluate_and_revise.
+    A local near-duplicate check still stops the loop even if the model
+    judged the critique substantive.
+    """
+    verdict = quick_refinement_verdict(step["critique"], previous_critique, iteration)
+    if verdict is not None and not verdict[0]:
+        return verdict, ""
+    if step["verdict"] == "NITPICKING":
+        return (
+            False,
+            "Critique devolved into nitpicking rather than substantive feedback",
+        ), ""
+    if not step["revision"]:
+        return (True, ""), RuntimeError("The model returned an empty revision.")
+    return (True, ""), step["revision"]
+
+
+def rule_key(rule: str) -> str:
+    return " ".join(rule.casefold().split()).rstrip(".")
+
+
+def parse_rules(text: str) -> List[str]:
+    """Return the markdown bullet items in text, one rule per bullet."""
+    rules = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith(("- ", "* ")) and stripped[2:].strip():
+            rules.append(stripped[2:].strip())
+    return rules
+
+
+def merge_rules(existing: List[str], new: List[str]) -> List[str]:
+    """
+    Merge rule lists, dropping duplicates and keeping the newest
+    MAX_MEMORY_RULES. A rule learned again moves to the end, so rules that
+    keep proving useful survive the cap.
+    """
+    merged: Dict[str, str] = {}
+    for rule in existing + new:
+        key = rule_key(rule)
+        merged.pop(key, None)
+        merged[key] = rule
+    return list(merged.values())[-MAX_MEMORY_RULES:]
+
 
+def load_reviewer_memory() -> str:
+    """
+    Return the reviewer guidelines learned from earlier runs.
+    Bullet rules from every markdown file in the memories directory are
+    merged in name order and capped to MAX_MEMORY_RULES whole rules. The
+    result is reused until one of the files changes.
+    """
+    global _reviewer_memory
+    if not os.path.isdir(MEMORY_DIR):
+        return ""
+
+    paths = [
+        os.path.join(MEMORY_DIR, filename)
+        for filename in sorted(os.listdir(MEMORY_DIR))
+        if filename.endswith(".md")
+    ]
+    signature = tuple((path, os.path.getmtime(path)) for path in paths)
+    if signature == _reviewer_memory[0]:
+        return _reviewer_memory[1]
+
+    rules: List[str] = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as memory_file:
+            rules = merge_rules(rules, parse_rules(memory_file.read()))
+
+    guidelines = ""
+    if rules:
+        guidelines = (
+            "Guidelines learned from previous reviews. Apply them when they are "
+            "relevant to this document:\n" + "\n".join(f"- {rule}" for rule in rules)
+        )
+    _reviewer_memory = (signature, guidelines)
+    return guidelines
 
-def should_continue_refinement(
+
+async def record_reviewer_memory(critiques: List[str]) -> None:
+    """Distill the rules that satisfied the reviewer and merge them into memory."""
+    try:
+        transcript = "\n\n".join(
+            f"Critique {index}:\n{critique_text}"
+            for index, critique_text in enumerate(critiques, start=1)
+        )
+        learned = parse_rules(
+            await cached_chat_completion("gpt-4o-mini", MEMORY_PROMPT, transcript)
+        )
+        if not learned:
+            return
+
+        os.makedirs(MEMORY_DIR, exist_ok=True)
+        # Runs finishing together, in this worker or another, would each
+        # rewrite rules.md from the same old copy and lose the other's rules,
+        # so the read-merge-rewrite holds an exclusive lock.
+        with open(os.path.join(MEMORY_DIR, RULES_LOCK_FILE), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            rules_path = os.path.join(MEMORY_DIR, RULES_MEMORY_FILE)
+            existing: List[str] = []
+            if os.path.isfile(rules_path):
+                with open(rules_path, "r", encoding="utf-8") as memory_file:
+                    existing = parse_rules(memory_file.read())
+            rules = merge_rules(existing, learned)
+
+            # Rewrite through a temp file so readers never see a partial file.
+            fd, temp_path = tempfile.mkstemp(dir=MEMORY_DIR, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as memory_file:
+                memory_file.write("# Reviewer rules\n\n")
+                memory_file.writelines(f"- {rule}\n" for rule in rules)
+            os.replace(temp_path, rules_path)
+    except Exception as exc:  # noqa: BLE001 - memory is an optional enhancement
+        _memory_logger.warning("Could not update reviewer memory: %s", exc)
+
+
+def quick_refinement_verdict(
     current_critique: str, previous_critique: str, iteration: int
-) -> Tuple[bool, str]:
+) -> Optional[Tuple[bool, str]]:
     """
-    Determine if another refinement loop is warranted.
-    Returns (should_continue, reason_for_stopping)
+    Decide whether to continue without asking the model, when possible.
+    A critique that barely changed from the previous loop is treated as
+    nitpicking, and one that shares little text with it as substantive.
+    Returns (should_continue, reason_for_stopping), or None when the model
+    should make the call.
     """
     if iteration >= 10:
         return False, "Maximum safety limit reached (10 iterations)"
@@ -179,32 +1025,95 @@ def should_continue_refinement(
     if iteration == 1:
         return True, ""
 
-    eval_prompt = (
-        "You are evaluating whether peer review feedback represents substantive "
-        "methodological concerns or has devolved into nitpicking and semantic quibbling. "
-        "Respond with ONLY 'SUBSTANTIVE' or 'NITPICKING'.\n\n"
-        f"Previous critique:\n{previous_critique}\n\n"
-        f"Current critique:\n{current_critique}\n\n"
-        "Has the critique shifted from addressing real methodological gaps to "
-        "nitpicking minor semantic issues or restating previous points?"
-    )
-
-    response = get_client().chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": eval_prompt}],
-        temperature=0.0,
-    )
+    matcher = difflib.SequenceMatcher(None, previous_critique, current_critique)
+    # quick_ratio() is an upper bound on ratio(), so a low bound settles the
+    # distinct case without the exact comparison.
+    if matcher.quick_ratio() < DISTINCT_CRITIQUE_RATIO:
+        return True, ""
+    similarity = matcher.ratio()
+    if similarity > NEAR_IDENTICAL_CRITIQUE_RATIO:
+        return False, "Critique nearly identical to previous iteration"
+    if similarity < DISTINCT_CRITIQUE_RATIO:
+        return True, ""
 
-    evaluation = response.choices[0].message.content.strip().upper()
+    return None
 
-    if "NITPICKING" in evaluation:
-        return False, "Critique devolved into nitpicking rather than substantive feedback"
 
-    return True, ""
+async def evaluate_and_revise(
+    document_text: str,
+    current_critique: str,
+    previous_critique: str,
+    iteration: int,
+    on_revision_delta: Optional[DeltaCallback] = None,
+) -> Tuple[Tuple[bool, str], Union[str, BaseException]]:
+    """
+    Revise the document unless the local stopping checks say to stop.
+    Only the first and safety-limit loops come through here; follow-up
+    loops get their verdict from the structured loop step.
+    Returns ((should_continue, reason_for_stopping), revision_or_error)
+    """
+    verdict = quick_refinement_verdict(current_critique, previous_critique, iteration)
+    if verdict is not None and not verdict[0]:
+        return verdict, ""
+    try:
+        revision = await generate_revision(
+            document_text, current_critique, on_revision_delta
+        )
+    except Exception as exc:  # noqa: BLE001
+        return (True, ""), exc
+    return (True, ""), revision
 
 
 def ensure_audit_directory() -> None:
-    os.makedirs("audit_trails", exist_ok=True)
+    global _audit_dir_ready
+    if not _audit_dir_ready:
+        os.makedirs(os.path.join("audit_trails", "blobs"), exist_ok=True)
+        _audit_dir_ready = True
+
+def append_to_audit_log(log_filename: str, parts: List[str]) -> None:
+    """
+    Append a complete audit record with a single write.
+    A short write (a full disk, an interrupted call) is continued until
+    every byte is on disk rather than silently truncating the record.
+    """
+    ensure_audit_directory()
+    log_path = os.path.join("audit_trails", log_filename)
+    data = memoryview("".join(parts).encode("utf-8"))
+    fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
+
+def store_audit_blob(content: str) -> str:
+    """
+    Store text under audit_trails/blobs keyed by its blake2b hash, once.
+    Returns the reference written into audit records ("blake2b:<hex>").
+    """
+    ensure_audit_directory()
+    data = content.encode("utf-8")
+    digest = hashlib.blake2b(data, digest_size=32).hexdigest()
+    blob_path = os.path.join("audit_trails", "blobs", f"{digest}.txt")
+    if os.path.exists(blob_path):
+        return f"blake2b:{digest}"
+
+    # Write to a private temp file and rename it into place, so a crash
+    # mid-write never leaves a truncated blob under the final name.
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(blob_path), prefix=f".{digest}.", suffix=".tmp"
+    )
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb") as blob_file:
+            blob_file.write(data)
+        os.replace(temp_path, blob_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return f"blake2b:{digest}"
+
 
 def append_loop_to_audit_log(
     log_filename: str,
@@ -214,28 +1123,50 @@ def append_loop_to_audit_log(
     revision: str,
     evaluation: str,
 ) -> None:
+    """
+    Append one loop to the audit log.
+    Only the submitted document is stored, as a content-addressed blob
+    referenced by hash. Every later loop's input is the previous loop's
+    revision, and each revision is recorded as a unified diff against its
+    input, so the whole chain can be rebuilt from the first blob.
+    """
     ensure_audit_directory()
-    log_path = os.path.join("audit_trails", log_filename)
-    header = f"Loop {iteration}\n"
-    with open(log_path, "a", encoding="utf-8") as log_file:
-        log_file.write(header)
-        log_file.write(f"Input Document:\n{document_text}\n\n")
-        log_file.write(f"Critique:\n{critique}\n\n")
-        log_file.write(f"Revision:\n{revision}\n\n")
-        log_file.write(f"Stopping evaluation: {evaluation}\n\n")
+    if iteration == 1:
+        document_ref = store_audit_blob(document_text)
+    else:
+        document_ref = f"revision from loop {iteration - 1}"
+    if revision == document_text:
+        revision_record = "Revision: unchanged\n\n"
+    else:
+        diff = difflib.unified_diff(
+            document_text.splitlines(),
+            revision.splitlines(),
+            fromfile=document_ref,
+            tofile="revision",
+            lineterm="",
+        )
+        revision_record = "Revision diff:\n" + "\n".join(diff) + "\n\n"
+
+    append_to_audit_log(
+        log_filename,
+        [
+            f"Loop {iteration}\n",
+            f"Input Document: {document_ref}\n\n",
+            f"Critique:\n{critique}\n\n",
+            revision_record,
+            f"Stopping evaluation: {evaluation}\n\n",
+        ],
+    )
 
 
 def append_summary_to_audit_log(
     log_filename: str, total_loops: int, stopping_reason: str
 ) -> None:
-    ensure_audit_directory()
-    log_path = os.path.join("audit_trails", log_filename)
-    with open(log_path, "a", encoding="utf-8") as log_file:
-        log_file.write("---\n")
-        log_file.write(f"Total loops completed: {total_loops}\n")
-        if stopping_reason:
-            log_file.write(f"Stopping reason: {stopping_reason}\n")
-        log_file.write("\n")
+    parts = ["---\n", f"Total loops completed: {total_loops}\n"]
+    if stopping_reason:
+        parts.append(f"Stopping reason: {stopping_reason}\n")
+    parts.append("\n")
+    append_to_audit_log(log_filename, parts)
 
 
 @app.route("/", methods=["GET"])
@@ -243,7 +1174,7 @@ def index():
     return render_template(
         "index.html",
         document_text="",
-        loops=[],
+        loops=_EMPTY_LOOPS,
         final_document="",
         log_file="",
         stop_reason="",
@@ -254,129 +1185,258 @@ def index():
     )
 
 
-@app.route("/critique", methods=["POST"])
-def critique():
-    document_text = request.form.get("document_text", "").strip()
+class RefinementCancelled(Exception):
+    """Raised inside a refinement when its consumer has gone away."""
+
 
+def run_refinement(
+    document_text: str,
+    log_file: str,
+    on_event: Optional[EventCallback] = None,
+    cancelled: Optional[threading.Event] = None,
+) -> Dict[str, Any]:
+    """
+    Run the critique/revision loop on a document until a stopping condition.
+    When on_event is given it receives ("critique", {iteration, delta}) and
+    ("revision", {iteration, delta}) as text streams in, and ("loop", entry)
+    once each loop is recorded. Structured follow-up loops deliver their
+    critique and revision as a single delta each.
+    Setting cancelled stops the run at the next loop or streamed delta, so
+    no further API calls are paid for.
+    """
     error_message = None
     loops: List[Dict[str, str]] = []
     final_document = document_text
     stop_reason = ""
     refinement_complete = False
-    log_file = ""
 
-    if not document_text:
-        error_message = "Please provide document text for critique."
-    elif not _client_ready:
-        error_message = (
-            "The OpenAI client could not be initialized at startup, so critiques "
-            "cannot be generated. Check the startup diagnostics below for the "
-            "recorded error and verify your OPENAI_API_KEY."
-        )
-    else:
-        log_file = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-        current_document = document_text
-        previous_critique = ""
-        iteration = 1
-        summary_reason = ""
+    current_document = document_text
+    previous_critique = ""
+    iteration = 1
+    summary_reason = ""
+    try:
+        guidelines = load_reviewer_memory()
+    except Exception as exc:  # noqa: BLE001 - memory is an optional enhancement
+        _memory_logger.warning("Could not load reviewer memory: %s", exc)
+        guidelines = ""
+
+    def check_cancelled() -> None:
+        if cancelled is not None and cancelled.is_set():
+            raise RefinementCancelled()
+
+    def emit(event: str, payload: Dict[str, Any]) -> None:
+        check_cancelled()
+        if on_event is not None:
+            on_event(event, payload)
+
+    def delta_callback(kind: str) -> Optional[DeltaCallback]:
+        if on_event is None and cancelled is None:
+            return None
+        loop_number = iteration
+        return lambda delta: emit(kind, {"iteration": loop_number, "delta": delta})
+
+    def finish_loop(loop_entry: Dict[str, str]) -> None:
+        if on_event is not None:
+            on_event("loop", dict(loop_entry))
 
-        try:
-            while True:
-                critique_text = generate_critique(current_document)
-                loop_entry: Dict[str, str] = {
-                    "iteration": str(iteration),
-                    "document": current_document,
-                    "critique": critique_text,
-                    "revision": current_document,
-                    "evaluation": "",
-                }
-                loops.append(loop_entry)
-
-                if "no substantive issues remain" in critique_text.lower():
-                    stop_reason = "Reviewer indicated no substantive issues remain."
-                    loop_entry["evaluation"] = stop_reason
-                    append_loop_to_audit_log(
-                        log_file,
-                        iteration,
-                        current_document,
-                        critique_text,
+    try:
+        while True:
+            check_cancelled()
+            step: Optional[Dict[str, str]] = None
+            if 1 < iteration < 10:
+                # Follow-up loops critique, evaluate and revise in one request.
+                step = run_async(
+                    generate_loop_step(current_document, previous_critique, guidelines)
+                )
+                critique_text = step["critique"]
+                emit("critique", {"iteration": iteration, "delta": critique_text})
+            else:
+                # Only the submitted draft is matched semantically; revisions
+                # are near-duplicates of their input by design.
+                critique_text = run_async(
+                    generate_critique(
                         current_document,
-                        stop_reason,
+                        semantic=iteration == 1,
+                        on_delta=delta_callback("critique"),
+                        guidelines=guidelines,
                     )
-                    final_document = current_document
-                    refinement_complete = True
-                    summary_reason = stop_reason
-                    break
-
-                continue_refinement, reason = should_continue_refinement(
-                    critique_text, previous_critique, iteration
                 )
-
-                if not continue_refinement:
-                    stop_reason = reason or "Stopping conditions met."
-                    loop_entry["evaluation"] = stop_reason
-                    append_loop_to_audit_log(
-                        log_file,
-                        iteration,
-                        current_document,
-                        critique_text,
-                        current_document,
-                        stop_reason,
+            loop_entry: Dict[str, str] = {
+                "iteration": str(iteration),
+                "document": current_document,
+                "critique": critique_text,
+                "revision": current_document,
+                "evaluation": "",
+            }
+            loops.append(loop_entry)
+
+            if NO_ISSUES_SENTINEL.search(critique_text) is not None or (
+                step is not None and step["verdict"] == "RESOLVED"
+            ):
+                stop_reason = "Reviewer indicated no substantive issues remain."
+                loop_entry["evaluation"] = stop_reason
+                append_loop_to_audit_log(
+                    log_file,
+                    iteration,
+                    current_document,
+                    critique_text,
+                    current_document,
+                    stop_reason,
+                )
+                finish_loop(loop_entry)
+                final_document = current_document
+                refinement_complete = True
+                summary_reason = stop_reason
+                if len(loops) > 1:
+                    # Learn from runs that needed revisions; the summary is
+                    # written in the background so the response is not delayed.
+                    asyncio.run_coroutine_threadsafe(
+                        record_reviewer_memory([entry["critique"] for entry in loops]),
+                        get_event_loop(),
                     )
-                    final_document = current_document
-                    refinement_complete = True
-                    summary_reason = stop_reason
-                    break
+                break
 
-                try:
-                    revision_text = generate_revision(current_document, critique_text)
-                except Exception as exc:  # noqa: BLE001
-                    error_message = (
-                        "An error occurred while generating the revision: "
-                        f"{exc}"
-                    )
-                    stop_reason = "Stopped due to revision generation error."
-                    loop_entry["evaluation"] = stop_reason
-                    append_loop_to_audit_log(
-                        log_file,
-                        iteration,
+            if step is None:
+                (continue_refinement, reason), revision_result = run_async(
+                    evaluate_and_revise(
                         current_document,
                         critique_text,
-                        current_document,
-                        stop_reason,
+                        previous_critique,
+                        iteration,
+                        on_revision_delta=delta_callback("revision"),
                     )
-                    summary_reason = stop_reason
-                    break
+                )
+            else:
+                (continue_refinement, reason), revision_result = resolve_loop_step(
+                    step, previous_critique, iteration
+                )
+                if continue_refinement and isinstance(revision_result, str):
+                    emit("revision", {"iteration": iteration, "delta": revision_result})
 
-                evaluation_message = "Continuing refinement (substantive issues remain)."
-                loop_entry["revision"] = revision_text
-                loop_entry["evaluation"] = evaluation_message
+            if isinstance(revision_result, RefinementCancelled):
+                raise revision_result
+
+            if not continue_refinement:
+                stop_reason = reason or "Stopping conditions met."
+                loop_entry["evaluation"] = stop_reason
                 append_loop_to_audit_log(
                     log_file,
                     iteration,
                     current_document,
                     critique_text,
-                    revision_text,
-                    evaluation_message,
+                    current_document,
+                    stop_reason,
                 )
-
-                previous_critique = critique_text
-                current_document = revision_text
-                final_document = revision_text
-                iteration += 1
-
-            if loops:
-                append_summary_to_audit_log(
+                finish_loop(loop_entry)
+                final_document = current_document
+                refinement_complete = True
+                summary_reason = stop_reason
+                break
+
+            if isinstance(revision_result, BaseException):
+                error_message = (
+                    "An error occurred while generating the revision: "
+                    f"{revision_result}"
+                )
+                stop_reason = "Stopped due to revision generation error."
+                loop_entry["evaluation"] = stop_reason
+                append_loop_to_audit_log(
                     log_file,
-                    len(loops),
-                    summary_reason or stop_reason,
+                    iteration,
+                    current_document,
+                    critique_text,
+                    current_document,
+                    stop_reason,
                 )
-        except Exception as exc:  # noqa: BLE001
-            error_message = f"An error occurred while generating the critique: {exc}"
-            summary_reason = "Stopped due to critique generation error."
-            if loops:
-                loops[-1]["evaluation"] = summary_reason
-                append_summary_to_audit_log(log_file, len(loops), summary_reason)
+                finish_loop(loop_entry)
+                summary_reason = stop_reason
+                break
+
+            revision_text = revision_result
+            evaluation_message = "Continuing refinement (substantive issues remain)."
+            loop_entry["revision"] = revision_text
+            loop_entry["evaluation"] = evaluation_message
+            append_loop_to_audit_log(
+                log_file,
+                iteration,
+                current_document,
+                critique_text,
+                revision_text,
+                evaluation_message,
+            )
+            finish_loop(loop_entry)
+
+            previous_critique = critique_text
+            current_document = revision_text
+            final_document = revision_text
+            iteration += 1
+
+        if loops:
+            append_summary_to_audit_log(
+                log_file,
+                len(loops),
+                summary_reason or stop_reason,
+            )
+    except RefinementCancelled:
+        stop_reason = "Stopped because the client disconnected."
+        if loops:
+            loops[-1]["evaluation"] = stop_reason
+            append_summary_to_audit_log(log_file, len(loops), stop_reason)
+    except Exception as exc:  # noqa: BLE001
+        error_message = f"An error occurred while generating the critique: {exc}"
+        summary_reason = "Stopped due to critique generation error."
+        if loops:
+            loops[-1]["evaluation"] = summary_reason
+            append_summary_to_audit_log(log_file, len(loops), summary_reason)
+
+    return {
+        "loops": loops,
+        "final_document": final_document,
+        "stop_reason": stop_reason,
+        "refinement_complete": refinement_complete,
+        "error_message": error_message,
+    }
+
+
+def validate_critique_request(document_text: str) -> Optional[str]:
+    if not document_text:
+        return "Please provide document text for critique."
+    if not _client_ready:
+        return (
+            "The OpenAI client could not be initialized at startup, so critiques "
+            "cannot be generated. Check the startup diagnostics below for the "
+            "recorded error and verify your OPENAI_API_KEY."
+        )
+    return None
+
+
+def new_audit_log_filename() -> str:
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+
+
+def format_sse_event(event: str, payload: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+@app.route("/critique", methods=["POST"])
+def critique():
+    document_text = request.form.get("document_text", "").strip()
+
+    loops: Sequence[Dict[str, str]] = _EMPTY_LOOPS
+    final_document = document_text
+    stop_reason = ""
+    refinement_complete = False
+    log_file = ""
+
+    error_message = validate_critique_request(document_text)
+    if error_message is None:
+        log_file = new_audit_log_filename()
+        result = run_refinement(document_text, log_file)
+        loops = result["loops"]
+        final_document = result["final_document"]
+        stop_reason = result["stop_reason"]
+        refinement_complete = result["refinement_complete"]
+        error_message = result["error_message"]
 
     return render_template(
         "index.html",
@@ -392,10 +1452,168 @@ def critique():
     )
 
 
-def main() -> None:
-    global _client_ready, _client_error, _api_key
+@app.route("/critique/stream", methods=["POST"])
+def critique_stream():
+    """
+    Server-sent events variant of /critique.
+    Emits critique and revision text, a loop event per completed loop, and a
+    final done event with the refinement outcome. Text streams as it is
+    generated only for the first and safety-limit loops; structured
+    follow-up loops send each as a single event once the response arrives.
+    """
+    document_text = request.form.get("document_text", "").strip()
+
+    error_message = validate_critique_request(document_text)
+    if error_message is not None:
+        return jsonify({"error_message": error_message}), 400
+
+    log_file = new_audit_log_filename()
+    events: "queue.Queue[Optional[Tuple[str, Dict[str, Any]]]]" = queue.Queue()
+    disconnected = threading.Event()
+
+    def refine() -> None:
+        try:
+            result = run_refinement(
+                document_text,
+                log_file,
+                lambda event, payload: events.put((event, payload)),
+                cancelled=disconnected,
+            )
+            result.pop("loops")
+            result["log_file"] = log_file
+            events.put(("done", result))
+        finally:
+            events.put(None)
+
+    threading.Thread(target=refine, name="marny-refinement", daemon=True).start()
+
+    def generate() -> Iterator[str]:
+        try:
+            while True:
+                item = events.get()
+                if item is None:
+                    break
+                yield format_sse_event(*item)
+        finally:
+            # Runs when the stream ends or the client disconnects; either way
+            # the refinement thread should not start more API calls.
+            disconnected.set()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+async def submit_batch(documents: List[str]) -> str:
+    """
+    Submit one critique request per document to the OpenAI Batch API.
+    The request file is kept in audit_trails for reference; custom ids are
+    "doc-<index>" in the order the documents were given.
+    Returns the batch id.
+    """
+    ensure_audit_directory()
+    batch_path = os.path.join(
+        "audit_trails", f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    )
+    with open(batch_path, "w", encoding="utf-8") as batch_file:
+        for index, document_text in enumerate(documents):
+            line = {
+                "custom_id": f"doc-{index}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": "gpt-4o-mini",
+                    "messages": [
+                        {"role": "system", "content": REVIEW_PROMPT},
+                        {"role": "user", "content": document_text},
+                    ],
+                    "temperature": 0,
+                },
+            }
+            batch_file.write(json.dumps(line) + "\n")
+
+    client = get_client()
+    with open(batch_path, "rb") as batch_file:
+        batch_data = batch_file.read()
+    uploaded = await call_openai(
+        lambda: client.files.create(
+            file=(os.path.basename(batch_path), batch_data), purpose="batch"
+        )
+    )
+    batch = await call_openai(
+        lambda: client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+    )
+    return batch.id
+
+
+async def wait_for_batch(
+    batch_id: str, poll_interval: float = BATCH_POLL_INTERVAL
+) -> Dict[str, str]:
+    """
+    Poll a batch until it finishes and return its critiques by custom id.
+    Requests that failed inside an otherwise completed batch are omitted.
+    """
+    client = get_client()
+    while True:
+        batch = await call_openai(lambda: client.batches.retrieve(batch_id))
+        if batch.status == "completed":
+            break
+        if batch.status in ("failed", "expired", "cancelled"):
+            raise RuntimeError(f"Batch {batch_id} ended with status '{batch.status}'.")
+        await asyncio.sleep(poll_interval)
+
+    if not batch.output_file_id:
+        return {}
+
+    output = await call_openai(lambda: client.files.content(batch.output_file_id))
+
+    critiques: Dict[str, str] = {}
+    for line in output.text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            continue
+        content = response["body"]["choices"][0]["message"]["content"]
+        critiques[result["custom_id"]] = content.strip()
+    return critiques
+
+
+def run_batch_critiques(paths: List[str]) -> None:
+    """Critique a set of document files through the Batch API and log the results."""
+    documents = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as document_file:
+            documents.append(document_file.read().strip())
+
+    batch_id = run_async(submit_batch(documents))
+    print(f"Submitted batch {batch_id} with {len(documents)} documents.", flush=True)
+    critiques = run_async(wait_for_batch(batch_id))
+
+    ensure_audit_directory()
+    log_path = os.path.join("audit_trails", f"{batch_id}.txt")
+    with open(log_path, "w", encoding="utf-8") as log_file:
+        for index, path in enumerate(paths):
+            critique_text = critiques.get(f"doc-{index}")
+            if critique_text is None:
+                critique_text = "No critique returned for this document."
+            log_file.write(f"Document: {path}\n")
+            log_file.write(f"Critique:\n{critique_text}\n\n")
+    print(f"Wrote {len(critiques)} critiques to {log_path}.", flush=True)
+
+
+def initialize() -> None:
+    global _client_ready, _client_error, _api_key, _startup_messages_cached
 
     _startup_events.clear()
+    _startup_messages_cached = ()
     _client_error = None
     _client_ready = False
 
@@ -482,14 +1700,85 @@ def main() -> None:
                 f"Failed to initialize OpenAI client: {exc}", level="error"
             )
 
-    record_startup_event("Starting Flask development server on http://localhost:5000 ...")
+    # Diagnostics are final once initialization finishes, so the warnings
+    # shown on every page are filtered once instead of per request.
+    _startup_messages_cached = tuple(
+        event for event in _startup_events if event["level"] != "info"
+    )
+    # Write the diagnostics out now, before any gunicorn fork copies them.
+    flush_startup_log()
+
+
+def serve(options: Dict[str, Any]) -> None:
+    """
+    Serve the already-initialized Flask app with gunicorn.
+    Workers are forked from this process after initialize() has run, so
+    diagnostics and client configuration happen once. Threaded workers are
+    used rather than gevent: OpenAI calls already run on the background
+    asyncio loop, and gevent's monkey-patching would take over that loop's
+    thread.
+    gunicorn is imported here because it only runs on POSIX systems; the
+    batch command and create_app() work without it.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    class MarnyServer(BaseApplication):
+        def __init__(self, options: Dict[str, Any]) -> None:
+            self.options = options
+            super().__init__()
+
+        def load_config(self) -> None:
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self) -> Flask:
+            return app
+
+    MarnyServer(options).run()
+
+
+def create_app() -> Flask:
+    """Entry point for running under an external gunicorn command."""
+    initialize()
+    return app
+
+
+def main() -> None:
+    initialize()
+
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        if len(sys.argv) == 2:
+            raise SystemExit("Usage: python app.py batch DOCUMENT [DOCUMENT ...]")
+        if not _client_ready:
+            raise SystemExit(f"Cannot submit a batch: {_client_error}")
+        run_batch_critiques(sys.argv[2:])
+        return
+
+    record_startup_event(
+        f"Starting gunicorn on http://{SERVER_BIND} with {SERVER_WORKERS} "
+        f"workers x {SERVER_THREADS} threads ..."
+    )
+    server_pid = os.getpid()
+    flush_startup_log()
     try:
-        app.run(debug=True, use_reloader=False)
+        serve(
+            {
+                "bind": SERVER_BIND,
+                "workers": SERVER_WORKERS,
+                "worker_class": "gthread",
+                "threads": SERVER_THREADS,
+                # Streamed and multi-loop critiques routinely outlive the
+                # default 30 second worker timeout.
+                "timeout": 600,
+            }
+        )
     except Exception as exc:  # noqa: BLE001
-        record_startup_event(f"Flask exited with an error: {exc}", level="error")
+        record_startup_event(f"gunicorn exited with an error: {exc}", level="error")
         raise
     finally:
-        record_startup_event("Flask development server has stopped.")
+        # Forked workers unwind through here as well; only the arbiter logs.
+        if os.getpid() == server_pid:
+            record_startup_event("gunicorn server has stopped.")
 
 
 if __name__ == "__main__":